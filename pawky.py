@@ -1,7 +1,18 @@
+import importlib
+import io
 import sys
 import re
 import math
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 BEGIN = 'BEGIN'
 END = 'END'
 
@@ -32,18 +43,27 @@ class Pawky:
     :ivar dict refun: Contains the pattern and the funtion to call when the pattern matches for each line.
     """
 
-    def __init__(self, fs=r'[ \t\n]+', autoparse=False):
+    def __init__(self, fs=r'[ \t\n]+', autoparse=False, engine=None):
         """Initializes the `Pawky` class.
 
         :param str fs: The field separator (regular expression) to use for splitting the records. Defaults to
                        '[ \\t\\n]+'.
         :param bool autoparse: If `True`, possible fields are automatically parsed to `int` or `float`. Defaults to
                                False.
+        :param str engine: Name of an alternative regular expression module with a `re` compatible API, like 're2' or
+                           'regex'. It'll be imported and used for all the pattern matching. The module must be
+                           installed separately. Defaults to None, which uses Python's `re`.
         """
+        self._re = re if engine is None else importlib.import_module(engine)
         self.CONVFMT = '%.6g'
         self.FILENAME = None
         self.FNR = 0
         self.FS = fs
+        self._FS_re = self._re.compile(fs)
+        # For the default whitespace FS, str.split with no separator does the same work in C, with no regex at all.
+        self._split_fields = str.split if fs in (r'[ \t\n]+', ' ') else self._FS_re.split
+        self._refun_re = {}
+        self._pat_cache = {}
         self.NF = None
         self.NR = 0
         self.OFMT = '%.6g'
@@ -63,6 +83,47 @@ class Pawky:
         self.__record = None
         self.__old_stdout = None
 
+        # Bind the math module's functions and constants as instance attributes, so things like `awk.sqrt` or `awk.pi`
+        # work without a costly __getattribute__ override on every attribute access.
+        self.__dict__.update({name: getattr(math, name) for name in dir(math) if not name.startswith('_')})
+
+    def _compile(self, r):
+        """Returns the compiled pattern for regular expression r, cached per (r, IGNORECASE). This avoids recompiling
+        (or re-looking-up in the re module cache) patterns that are matched once per record."""
+        key = (r, self.IGNORECASE)
+        pattern = self._pat_cache.get(key)
+        if pattern is None:
+            pattern = self._pat_cache[key] = self._re.compile(r, self._re.IGNORECASE if self.IGNORECASE else 0)
+        return pattern
+
+    def compile_aggregator(self, fun, cols, state):
+        """Installs a `mid` function that packs the given fields of every record into a scratch float array (reused
+        across records) and calls fun(fields, state). fun is typically a numba @njit compiled function and state a
+        numpy array it accumulates into, so the per-record arithmetic runs as compiled code instead of in the
+        interpreter. Like the `$` syntax, the fields are 1-indexed; as in `awk`, non-numeric and missing fields count
+        as 0. Requires numpy to be installed.
+
+        :param function fun: The aggregator, called as fun(fields, state) for every record.
+        :param list cols: The fields to pack, 1-indexed.
+        :param state: The accumulator passed through to fun; returned for convenience.
+        :return: state.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for compile_aggregator')
+        scratch = numpy.empty(len(cols))
+        cols = [c - 1 for c in cols]
+
+        def mid(record):
+            fields = record.fields
+            for i, c in enumerate(cols):
+                try:
+                    scratch[i] = float(fields[c])
+                except (ValueError, IndexError):
+                    scratch[i] = 0.0
+            fun(scratch, state)
+        self.mid = mid
+        return state
+
     def gsub(self, r, s, t=None):
         """Global substitution, every match of regular expression r in variable t is replaced by string s. The replaced
         string and the number of replacements is returned. If t is omitted, $0 is used. An \i in the replacement string
@@ -74,7 +135,7 @@ class Pawky:
         """
         if t is None:
             t = self.__record['$0']
-        return re.subn(r, s, t, flags=self.IGNORECASE)
+        return self._compile(r).subn(s, t)
 
     def index(self, s, t):
         """If t is a substring of s, then the position where t starts is returned, else 0 is returned. The first
@@ -93,7 +154,7 @@ class Pawky:
         side effect, RSTART is set to the return value. RLENGTH is set to the length of the match or -1 if no match. If
         the empty string is matched, RLENGTH is set to 0, and 1 is returned if the match is at the front, and
         length(s)+1 is returned if the match is at the back."""
-        m = re.search(r, s, flags=self.IGNORECASE)
+        m = self._compile(r).search(s)
         if m is None:
             self.RSTART = 0
             self.RLENGTH = -1
@@ -107,13 +168,13 @@ class Pawky:
         """String s is split into fields by regular expression r and the fields are loaded into array A. If A is
         omitted, fields is returned. Otherwise, A is assumed to be a list and the fields are loaded into it and the
         number of fields is returned. If r is omitted, FS is used."""
-        if r is None:
-            r = self.FS
         s = str(s)
-        if r == ' ':
-            s = s.strip()
-            r = r'[ \t\n]+'
-        fields = re.split(r, s)
+        if r is None:
+            fields = self._split_fields(s)
+        elif r == ' ':
+            fields = s.split()
+        else:
+            fields = self._compile(r).split(s)
         if A is None:
             return fields
         else:
@@ -133,13 +194,31 @@ class Pawky:
         """
         if t is None:
             t = self.__record['$0']
-        return re.subn(r, s, t, count=1, flags=self.IGNORECASE)
+        return self._compile(r).subn(s, t, count=1)
 
     def substr(self, s, i, n=None):
         """Returns the substring of string s, starting at index i, of length n. If n is omitted, the suffix of s,
         starting at i is returned."""
         return s[i:] if n is None else s[i:i+n]
 
+    def sum_fields(self, cols):
+        """Installs a `mid` function that sums the given fields of every record and returns the accumulator. Like the
+        `$` syntax, the fields are 1-indexed. The accumulator is a numpy float array if numpy is installed, otherwise a
+        list of floats; read it after processing, e.g. in the END function. As in `awk`, non-numeric and missing fields
+        count as 0."""
+        totals = numpy.zeros(len(cols)) if numpy is not None else [0.0] * len(cols)
+        cols = [c - 1 for c in cols]
+
+        def mid(record):
+            fields = record.fields
+            for i, c in enumerate(cols):
+                try:
+                    totals[i] += float(fields[c])
+                except (ValueError, IndexError):
+                    pass
+        self.mid = mid
+        return totals
+
     def tolower(self, s):
         """Returns a copy of s with all upper case characters converted to lower case."""
         return s.lower()
@@ -188,17 +267,6 @@ class Pawky:
         else:  # str or int or (field, str)
             self.refun[key] = value
 
-    def __getattribute__(self, name):
-        """Return the attributes of Pawky and allows for calling arithmetic functions directly from the math module.
-
-        :param str name: The attribute name.
-        :return: The attribute value.
-        """
-        try:
-            return super().__getattribute__(name)
-        except AttributeError:
-            return getattr(math, name)
-
     def __call__(self, *fns, fs=r'[ \t\n]+', asregex=True):
         """Processes all the files passed.
         Since there's no way to know how many times this will be called, unlike `awk`, here BEGIN and END are called
@@ -208,7 +276,8 @@ class Pawky:
         be passed to all the functions.
 
         Note that, this'll reset FNR to 0 everytime this is called, before processing any files. This'll also reset NR
-        to 0 before processing each of the files, just like in `awk`.
+        to 0 before processing each of the files, just like in `awk`. The patterns are compiled for dispatch only
+        after BEGIN returns, so patterns registered inside the BEGIN function are matched too.
 
         :param str fns: The files to process.
         :param str fs: The file separator (regular expression) to use for the files, defaults to '[ \\t\\n]+'. This will
@@ -216,37 +285,124 @@ class Pawky:
         :param bool asregex: If True, fs is used as a regular expression, otherwise it is used as it is, like a string.
                              Defaults to True.
         """
-        self.FS = fs if asregex else re.escape(fs)
+        self.FS = fs if asregex else self._re.escape(fs)
+        flags = self._re.IGNORECASE if self.IGNORECASE else 0
+        self._FS_re = self._re.compile(self.FS, flags)
+        self._split_fields = str.split if self.FS in (r'[ \t\n]+', ' ') else self._FS_re.split
         if self.begin is not None:
             self.begin()
+        self._refun_re = {}
+        for k in self.refun:
+            if isinstance(k, str):
+                self._refun_re[k] = self._re.compile(k, flags)
+            elif isinstance(k, tuple) and len(k) == 2:
+                self._refun_re[k] = self._re.compile(k[1], flags)
+        hs_db = hs_keys = None
+        if hyperscan is not None:
+            hs_keys = [k for k in self.refun if isinstance(k, str)]
+            if hs_keys:
+                hs_flag = hyperscan.HS_FLAG_CASELESS if self.IGNORECASE else 0
+                try:  # compile all the record patterns into one database, scanned in a single pass per record
+                    hs_db = hyperscan.Database()
+                    hs_db.compile(expressions=[k.encode() for k in hs_keys], ids=list(range(len(hs_keys))),
+                                  flags=[hs_flag] * len(hs_keys))
+                except hyperscan.error:  # not every re pattern is supported, fall back to re
+                    hs_db = None
+        # Partition the refun keys by type once, so the per-record dispatch doesn't run an isinstance chain over
+        # every key. Line numbers become O(1) dict lookups.
+        refun_nr = {}
+        refun_fnr = {}
+        refun_str = []
+        refun_field = []
+        refun_slice_nr = []
+        refun_slice_fnr = []
+        for k, fun in self.refun.items():
+            if isinstance(k, int):
+                if k > 0:
+                    refun_nr[k] = fun
+                else:
+                    refun_fnr[-k] = fun
+            elif isinstance(k, str):
+                refun_str.append((self._refun_re[k], fun))
+            elif len(k) == 2:
+                refun_field.append((k[0], self._refun_re[k], fun))
+            else:
+                start, stop, step = k
+                (refun_slice_nr if step > 0 else refun_slice_fnr).append((start, stop, abs(step), fun))
+        # With several record patterns, one search of their alternation filters out the records that match none of
+        # them, so most records pay a single regex call instead of one per pattern. Backreferences would renumber
+        # across the alternation, so such patterns disable the prefilter.
+        refun_str_combo = None
+        if hs_db is None and len(refun_str) > 1:
+            str_keys = [k for k in self.refun if isinstance(k, str)]
+            if not any(self._re.search(r'\\\d', k) for k in str_keys):
+                try:
+                    refun_str_combo = self._re.compile('|'.join('(?:%s)' % k for k in str_keys), flags)
+                except self._re.error:
+                    refun_str_combo = None
+        # Block-buffer the output while processing; the default mid otherwise pays two write calls and a flush to
+        # the (line-buffered) stdout for every record. The buffered wrapper is flushed and removed at the end.
+        old_stdout = sys.stdout
+        if hasattr(old_stdout, 'buffer'):
+            old_stdout.flush()
+            sys.stdout = io.TextIOWrapper(old_stdout.buffer, encoding=old_stdout.encoding, line_buffering=False,
+                                          write_through=False)
+        try:
+            self.__process(fns, hs_db, hs_keys, refun_nr, refun_fnr, refun_str, refun_str_combo, refun_field,
+                           refun_slice_nr, refun_slice_fnr)
+            if self.end is not None:
+                self.end()
+        finally:
+            if sys.stdout is not old_stdout:
+                sys.stdout.flush()
+                sys.stdout.detach()  # don't let the wrapper close the underlying buffer
+                sys.stdout = old_stdout
+
+    def __process(self, fns, hs_db, hs_keys, refun_nr, refun_fnr, refun_str, refun_str_combo, refun_field,
+                  refun_slice_nr, refun_slice_fnr):
         self.FNR = 0
+        self.__record = Record(self, '')
         for fn in fns:
             self.FILENAME = fn
             with open(self.FILENAME) as f:
                 self.NR = 0
-                for record in re.split(self.RS, f.read()):
+                if self.RS == '\n':  # stream the file instead of reading it whole
+                    records = (record[:-1] if record.endswith('\n') else record for record in f)
+                elif self.RS == '\r\n' or (len(self.RS) == 1 and self._re.escape(self.RS) == self.RS):
+                    records = f.read().split(self.RS)
+                else:
+                    records = self._re.compile(self.RS).split(f.read())
+                for record in records:
                     self.FNR += 1
                     self.NR += 1
-                    self.__record = Record(self, record)
+                    self.__record.reset(record)
                     if self.mid is not None:
                         self.mid(self.__record)
-                    for k in self.refun:
-                        if isinstance(k, int):
-                            if (k > 0 and k == self.NR) or (k < 0 and -k == self.FNR):
-                                self.refun[k](self.__record)
-                        elif isinstance(k, str):
-                            if re.search(k, record, re.IGNORECASE if self.IGNORECASE else 0):
-                                self.refun[k](self.__record)
-                        elif isinstance(k, tuple):
-                            if len(k) == 2:
-                                if re.search(k[1], str(self.__record[k[0]]), re.IGNORECASE if self.IGNORECASE else 0):
-                                    self.refun[k](self.__record)
-                            elif len(k) == 3:
-                                i = self.NR if k[2] > 0 else self.FNR
-                                if (k[1] is None or i < k[1]) and i >= k[0] and (i - k[0]) % k[2] == 0:
-                                    self.refun[k](self.__record)
-        if self.end is not None:
-            self.end()
+                    fun = refun_nr.get(self.NR)
+                    if fun is not None:
+                        fun(self.__record)
+                    fun = refun_fnr.get(self.FNR)
+                    if fun is not None:
+                        fun(self.__record)
+                    if hs_db is not None:
+                        hs_ids = set()
+                        hs_db.scan(record.encode(),
+                                   match_event_handler=lambda id, start, end, fl, ctx: hs_ids.add(id))
+                        for i in hs_ids:
+                            self.refun[hs_keys[i]](self.__record)
+                    elif refun_str_combo is None or refun_str_combo.search(record):
+                        for pattern, fun in refun_str:
+                            if pattern.search(record):
+                                fun(self.__record)
+                    for field, pattern, fun in refun_field:
+                        if pattern.search(str(self.__record[field])):
+                            fun(self.__record)
+                    for start, stop, step, fun in refun_slice_nr:
+                        if (stop is None or self.NR < stop) and self.NR >= start and (self.NR - start) % step == 0:
+                            fun(self.__record)
+                    for start, stop, step, fun in refun_slice_fnr:
+                        if (stop is None or self.FNR < stop) and self.FNR >= start and (self.FNR - start) % step == 0:
+                            fun(self.__record)
 
     def __lt__(self, value):
         """Used to simulate input redirection. This allows to call Pawky with a file as `awk < 'filename'`. The input
@@ -303,11 +459,20 @@ class Pawky:
 class Record:
     """The record class. All the methods from the parent Pawky class are also available.
 
+    Note that, Pawky reuses a single Record instance for all the lines, so the record passed to the functions mutates
+    in place when the next line is read. Don't keep the record object itself across lines; copy what you need instead,
+    like `str(record)` for the line or `list(record.fields)` for the fields.
+
     :ivar Pawky awk: The parent `awk` class.
     :ivar str record: The record string, this'll be updated if the fields change.
     :ivar list fields: The fields of the record.
     """
 
+    __slots__ = ('awk', '_record', '_dirty', '_fields')
+
+    _int_match = re.compile(r'[-+]?\d+$').match
+    _float_match = re.compile(r'[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?$').match
+
     def __init__(self, awk, record):
         """Initialize the record class. This is used internally by Pawky.
 
@@ -315,12 +480,52 @@ class Record:
         :param str record: The record line.
         """
         self.awk = awk
-        self.record = record
-        self.fields = re.split(awk.FS, record)
-        self.awk.NF = len(self.fields)
-        self.parse_fields()
+        self.reset(record)
+
+    def reset(self, record):
+        """Loads a new record line into this instance. This is used internally by Pawky to reuse a single Record
+        instead of allocating one per line. The fields are split lazily, on first access.
+
+        :param str record: The record line.
+        """
+        self._record = record
+        self._dirty = False
+        self._fields = None
+
+    @property
+    def fields(self):
+        """The fields of the record, split lazily on first access. Functions that only look at the whole record never
+        pay for the split."""
+        if self._fields is None:
+            self._fields = self.awk._split_fields(self._record)
+            self.awk.NF = len(self._fields)
+            self.parse_fields()
+        return self._fields
+
+    @fields.setter
+    def fields(self, value):
+        self._fields = value
+        self.awk.NF = len(value)
+
+    @property
+    def NF(self):
+        """Number of fields in the record. Accessing this splits the record if it wasn't split already."""
+        self.fields
+        return self.awk.NF
+
+    @property
+    def record(self):
+        """The record string. If any field was assigned since the last read, it's rebuilt here with the OFS, so
+        assigning several fields in a row doesn't rejoin the record each time."""
+        if self._dirty:
+            self._record = self.awk.OFS.join(map(str, self.fields))
+            self._dirty = False
+        return self._record
 
-        self.__idx = 0
+    @record.setter
+    def record(self, value):
+        self._record = value
+        self._dirty = False
 
     def parse_fields(self, forced=False):
         """Parse the fields to `int` or `float` if possible and if Pawky.autoparse is True.
@@ -329,14 +534,27 @@ class Record:
                             False.
         """
         if self.awk.autoparse or forced:
-            for i in range(self.awk.NF):
-                try:
-                    self.fields[i] = int(self.fields[i])
-                except:
-                    try:
-                        self.fields[i] = float(self.fields[i])
-                    except:
-                        pass
+            # Classifying with precompiled regexes avoids raising (up to two) exceptions per non-numeric field.
+            fields = self.fields
+            for i, field in enumerate(fields):
+                if isinstance(field, str):
+                    if self._int_match(field):
+                        fields[i] = int(field)
+                    elif self._float_match(field):
+                        fields[i] = float(field)
+
+    def as_ndarray(self, start=1, stop=None):
+        """Returns the fields from start (inclusive) to stop (exclusive) as a numpy float array, so per-record
+        arithmetic like summing marks can be vectorized. Like the `$` syntax, the indexing is 1-based. Requires numpy
+        to be installed.
+
+        :param int start: The first field to include. Defaults to 1.
+        :param int stop: The field to stop before. If omitted, all the fields from start are included.
+        :return: The fields as a float array.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for as_ndarray')
+        return numpy.asarray(self.fields[start - 1:None if stop is None else stop - 1], dtype=numpy.float64)
 
     def __str__(self):
         """Returns the string representation of the current record.
@@ -352,7 +570,7 @@ class Record:
         :return: Number of fields.
         :rtype: int
         """
-        return self.awk.NF
+        return len(self.fields)
 
     def __getitem__(self, key):
         """Returns the fields from the record. The key can be one of:
@@ -371,18 +589,18 @@ class Record:
         :return: The field value.
         """
         if isinstance(key, str):
-            if key.startswith('$') or key.startswith('S') or key.startswith('D') or key.startswith('F'):
+            if key.startswith(('$', 'S', 'D', 'F')):
                 key = key[1:]
             try:
                 idx = int(key)
             except ValueError:
-                idx = self.__getattribute__(key)
+                idx = getattr(self, key)
             if idx == 0:
                 return self.record
-            elif idx <= self.awk.NF:
-                return self.fields[idx - 1]
-            else:
-                return ''
+            fields = self.fields
+            if idx <= self.awk.NF:
+                return fields[idx - 1]
+            return ''
         else:
             return self.fields[key]
 
@@ -401,62 +619,47 @@ class Record:
         :param value: The new value of the field or record.
         """
         if isinstance(key, str):
-            if key.startswith('$') or key.startswith('S') or key.startswith('D') or key.startswith('F'):
+            if key.startswith(('$', 'S', 'D', 'F')):
                 key = key[1:]
             try:
                 idx = int(key)
             except ValueError:
-                idx = self.__getattribute__(key)
+                idx = getattr(self, key)
             if idx == 0:
                 self.record = value
-                self.fields = re.split(self.awk.FS, value)
-                self.awk.NF = len(self.fields)
-                self.parse_fields()
+                self._fields = None  # re-split lazily on the next access
                 return
-            elif idx > self.awk.NF:
-                self.fields += [''] * (idx - self.awk.NF)
+            fields = self.fields
+            if idx > self.awk.NF:
+                fields += [''] * (idx - self.awk.NF)
                 self.awk.NF = idx
             idx -= 1
         else:
             idx = key
+        if self.awk.autoparse and isinstance(value, str):  # only the changed field needs parsing
+            if self._int_match(value):
+                value = int(value)
+            elif self._float_match(value):
+                value = float(value)
         self.fields[idx] = value
-        self.record = self.awk.OFS.join(map(str, self.fields))
-        self.parse_fields()
+        self._dirty = True
 
-    def __getattribute__(self, name):
-        """Return the attributes of the record. This also allows the record to access the attributes of its parent Pawky
-        instance. You can also access the fields this way. For instance, doing `record.S1` is the same as doing
-        `record['S1']`.
+    def __getattr__(self, name):
+        """Called only when an attribute is not found on the record, so normal attribute access stays at C speed. This
+        allows the record to access the attributes of its parent Pawky instance. You can also access the fields this
+        way. For instance, doing `record.S1` is the same as doing `record['S1']`.
 
         :param str name: The attribute name.
         :return: The attribute value.
         """
         try:
-            return super().__getattribute__(name)
+            return self.awk.__getattribute__(name)
         except AttributeError:
-            try:
-                return self.awk.__getattribute__(name)
-            except AttributeError:
-                return self[name]
+            return self[name]
 
     def __iter__(self):
         """Allows the record to be iterated over. Use as `for r in record`.
 
-        :return: The iterator (itself).
-        :rtype: Record
+        :return: The iterator over the fields.
         """
-        self.__idx = 0
-        return self
-
-    def __next__(self):
-        """Returns the next field for the iterator.
-
-        :raises StopIteration: Exception to stop iteration.
-        :return: The field value.
-        """
-        if self.__idx < self.awk.NF:
-            field = self.fields[self.__idx]
-            self.__idx += 1
-            return field
-        else:
-            raise StopIteration
+        return iter(self.fields)